@@ -5,11 +5,20 @@ Version: 1.1
 """
 
 import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support
 from tree_library.json_tree_modified import create_json_tree
 from tree_library.tree_validation import validate_tree
 from tree_library.node_link_validation import process_linkage
 from tkinter import filedialog, messagebox
 
+FILE_LABELS = {
+    'tree_data': "File 1 (knowledge tree)",
+    'study_design': "File 2 (study design)",
+    'key_data': "File 3 (chosen topics)",
+    'link_data': "File 4 (node linkages)"
+}
+
 
 # Function to handle file selection
 def open_file_dialog(entry_field):
@@ -54,6 +63,7 @@ def display_options():
 # Function to process files based on user input
 def process_files():
 
+    selected_option = None
     if validate_linkage_var.get():
         selected_option = display_options()
         if not selected_option:
@@ -76,84 +86,126 @@ def process_files():
     if link_data_path.get():
         file_paths['link_data'] = link_data_path.get()
 
-    # process the files based on selected options
-    try:
-        method_selected = False
-        if create_json_var.get():
-            method_selected = True
-            create_json_tree(file_paths['tree_data'], output_directory)
-        if validate_tree_var.get():
-            method_selected = True
-            output_file_txt = f"{output_directory}/knowledge_tree_report.txt"
-            validate_tree(file_paths['key_data'], file_paths['study_design'], file_paths['tree_data'], output_file_txt)
-        if validate_linkage_var.get() and selected_option:
-            method_selected = True
-            process_linkage(selected_option, file_paths['tree_data'], file_paths['link_data'], output_directory)
-            
-    except Exception as e:
-        messagebox.showwarning("An Error Occurred", f"Error: {e}")
+    # collect the stages that were selected, they do not depend on each other
+    stages = {}
+    errors = []
+    if create_json_var.get() and check_files("Create Json Tree", ['tree_data'], file_paths, errors):
+        stages["Create Json Tree"] = (create_json_tree, file_paths['tree_data'], output_directory,
+                                      split_years_var.get())
+    if validate_tree_var.get() and check_files("Validate Json Tree", ['key_data', 'study_design', 'tree_data'],
+                                               file_paths, errors):
+        output_file_txt = f"{output_directory}/knowledge_tree_report.txt"
+        stages["Validate Json Tree"] = (validate_tree, file_paths['key_data'], file_paths['study_design'],
+                                        file_paths['tree_data'], output_file_txt)
+    if validate_linkage_var.get() and selected_option and check_files("Validate Linkage", ['tree_data', 'link_data'],
+                                                                      file_paths, errors):
+        stages["Validate Linkage"] = (process_linkage, selected_option, file_paths['tree_data'],
+                                      file_paths['link_data'], output_directory)
+
+    # run all the stages at the same time and report all the errors together
+    errors += run_stages(stages)
+    if errors:
+        messagebox.showwarning("An Error Occurred", "\n".join(errors))
         return
 
     # successful execution, yeah!
-    if method_selected:
+    if stages:
         messagebox.showinfo("Success", f"Files saved to {output_directory}")
     else:
         messagebox.showwarning("No Files Processed", "No process method selected.")
 
-# Create the main window
-root = tk.Tk()  # Use TkinterDnD's main window for drag and drop
-root.title("Knowledge Tree Processing Application")
-root.config(bg='#f0f8ff')  # Light color background (AliceBlue)
-
-# Set a uniform padding for better layout
-PADX, PADY = 20, 10
-
-# Create fields to hold file paths
-tree_data_path = tk.Entry(root, width=40)
-study_design_path = tk.Entry(root, width=40)
-keys_data_path = tk.Entry(root, width=40)
-link_data_path = tk.Entry(root, width=40)
-
-# Checkboxes to select processing methods
-create_json_var = tk.BooleanVar()
-validate_tree_var = tk.BooleanVar()
-validate_linkage_var = tk.BooleanVar()
-
-create_json_checkbox = tk.Checkbutton(root, text="Create Json Tree", variable=create_json_var, bg='#f0f8ff')
-validate_tree_checkbox = tk.Checkbutton(root, text="Validate Json Tree", variable=validate_tree_var, bg='#f0f8ff')
-validate_linkage_checkbox = tk.Checkbutton(root, text="Validate Linkage", variable=validate_linkage_var, bg='#f0f8ff')
-
-# Buttons to open file dialogs
-open_tree_data_button = tk.Button(root, text="Open File 1", command=lambda: open_file_dialog(tree_data_path), bg='#add8e6')
-open_study_design_button = tk.Button(root, text="Open File 2", command=lambda: open_file_dialog(study_design_path), bg='#add8e6')
-open_keys_data_button = tk.Button(root, text="Open File 3", command=lambda: open_file_dialog(keys_data_path), bg='#add8e6')
-open_link_data_button = tk.Button(root, text="Open File 4", command=lambda: open_file_dialog(link_data_path), bg='#add8e6')
-
-# Button to process files
-process_button = tk.Button(root, text="Process and Save Files", command=process_files, bg='#4682b4', fg='white')
-
-# Layout for the UI with better padding
-tk.Label(root, text="Select File 1 For Knowledge Tree:", bg='#f0f8ff').grid(row=0, column=0, padx=PADX, pady=PADY, sticky="e")
-tree_data_path.grid(row=0, column=1, padx=PADX, pady=PADY)
-create_json_checkbox.grid(row=4, column=0, padx=PADX, pady=PADY)
-open_tree_data_button.grid(row=0, column=3, padx=PADX, pady=PADY)
-
-tk.Label(root, text="Select File 2 For Current Study Design:", bg='#f0f8ff').grid(row=1, column=0, padx=PADX, pady=PADY, sticky="e")
-study_design_path.grid(row=1, column=1, padx=PADX, pady=PADY)
-validate_tree_checkbox.grid(row=4, column=1, padx=PADX, pady=PADY)
-open_study_design_button.grid(row=1, column=3, padx=PADX, pady=PADY)
-
-tk.Label(root, text="Select File 3 For Chosen Topics:", bg='#f0f8ff').grid(row=2, column=0, padx=PADX, pady=PADY, sticky="e")
-keys_data_path.grid(row=2, column=1, padx=PADX, pady=PADY)
-validate_linkage_checkbox.grid(row=4, column=2, padx=PADX, pady=PADY)
-open_keys_data_button.grid(row=2, column=3, padx=PADX, pady=PADY)
-
-tk.Label(root, text="Select File 4 For Node Linkages:", bg='#f0f8ff').grid(row=3, column=0, padx=PADX, pady=PADY, sticky="e")
-link_data_path.grid(row=3, column=1, padx=PADX, pady=PADY)
-open_link_data_button.grid(row=3, column=3, padx=PADX, pady=PADY)
-
-process_button.grid(row=5, columnspan=4, pady=PADY)
-tk.Label(root, text="Version: 2.0.1", bg='#f0f8ff').grid(row=5, column=3, padx=PADX, pady=PADY, sticky="e")
-
-# Start the main event loop
-root.mainloop()
+
+def check_files(name, required, file_paths, errors):
+    """ check that all the files a stage needs were selected, add an
+    error for the stage if any are missing.
+    """
+    missing = [FILE_LABELS[key] for key in required if key not in file_paths]
+    if missing:
+        errors.append(f"{name}: missing {', '.join(missing)}")
+
+    return not missing
+
+
+def run_stages(stages):
+    """ run each stage in its own process and return the errors of
+    all the stages that failed.
+    """
+    errors = []
+    if not stages:
+        return errors
+
+    with ProcessPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {name: executor.submit(*stage) for name, stage in stages.items()}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+
+    return errors
+
+
+if __name__ == "__main__":
+    # child processes import this file again, only the parent builds the UI
+    freeze_support()
+
+    # Create the main window
+    root = tk.Tk()  # Use TkinterDnD's main window for drag and drop
+    root.title("Knowledge Tree Processing Application")
+    root.config(bg='#f0f8ff')  # Light color background (AliceBlue)
+
+    # Set a uniform padding for better layout
+    PADX, PADY = 20, 10
+
+    # Create fields to hold file paths
+    tree_data_path = tk.Entry(root, width=40)
+    study_design_path = tk.Entry(root, width=40)
+    keys_data_path = tk.Entry(root, width=40)
+    link_data_path = tk.Entry(root, width=40)
+
+    # Checkboxes to select processing methods
+    create_json_var = tk.BooleanVar()
+    validate_tree_var = tk.BooleanVar()
+    validate_linkage_var = tk.BooleanVar()
+    split_years_var = tk.BooleanVar()
+
+    create_json_checkbox = tk.Checkbutton(root, text="Create Json Tree", variable=create_json_var, bg='#f0f8ff')
+    validate_tree_checkbox = tk.Checkbutton(root, text="Validate Json Tree", variable=validate_tree_var, bg='#f0f8ff')
+    validate_linkage_checkbox = tk.Checkbutton(root, text="Validate Linkage", variable=validate_linkage_var, bg='#f0f8ff')
+    split_years_checkbox = tk.Checkbutton(root, text="Split By Year Level", variable=split_years_var, bg='#f0f8ff')
+
+    # Buttons to open file dialogs
+    open_tree_data_button = tk.Button(root, text="Open File 1", command=lambda: open_file_dialog(tree_data_path), bg='#add8e6')
+    open_study_design_button = tk.Button(root, text="Open File 2", command=lambda: open_file_dialog(study_design_path), bg='#add8e6')
+    open_keys_data_button = tk.Button(root, text="Open File 3", command=lambda: open_file_dialog(keys_data_path), bg='#add8e6')
+    open_link_data_button = tk.Button(root, text="Open File 4", command=lambda: open_file_dialog(link_data_path), bg='#add8e6')
+
+    # Button to process files
+    process_button = tk.Button(root, text="Process and Save Files", command=process_files, bg='#4682b4', fg='white')
+
+    # Layout for the UI with better padding
+    tk.Label(root, text="Select File 1 For Knowledge Tree:", bg='#f0f8ff').grid(row=0, column=0, padx=PADX, pady=PADY, sticky="e")
+    tree_data_path.grid(row=0, column=1, padx=PADX, pady=PADY)
+    create_json_checkbox.grid(row=4, column=0, padx=PADX, pady=PADY)
+    open_tree_data_button.grid(row=0, column=3, padx=PADX, pady=PADY)
+
+    tk.Label(root, text="Select File 2 For Current Study Design:", bg='#f0f8ff').grid(row=1, column=0, padx=PADX, pady=PADY, sticky="e")
+    study_design_path.grid(row=1, column=1, padx=PADX, pady=PADY)
+    validate_tree_checkbox.grid(row=4, column=1, padx=PADX, pady=PADY)
+    open_study_design_button.grid(row=1, column=3, padx=PADX, pady=PADY)
+
+    tk.Label(root, text="Select File 3 For Chosen Topics:", bg='#f0f8ff').grid(row=2, column=0, padx=PADX, pady=PADY, sticky="e")
+    keys_data_path.grid(row=2, column=1, padx=PADX, pady=PADY)
+    validate_linkage_checkbox.grid(row=4, column=2, padx=PADX, pady=PADY)
+    split_years_checkbox.grid(row=4, column=3, padx=PADX, pady=PADY)
+    open_keys_data_button.grid(row=2, column=3, padx=PADX, pady=PADY)
+
+    tk.Label(root, text="Select File 4 For Node Linkages:", bg='#f0f8ff').grid(row=3, column=0, padx=PADX, pady=PADY, sticky="e")
+    link_data_path.grid(row=3, column=1, padx=PADX, pady=PADY)
+    open_link_data_button.grid(row=3, column=3, padx=PADX, pady=PADY)
+
+    process_button.grid(row=5, columnspan=4, pady=PADY)
+    tk.Label(root, text="Version: 2.0.1", bg='#f0f8ff').grid(row=5, column=3, padx=PADX, pady=PADY, sticky="e")
+
+    # Start the main event loop
+    root.mainloop()
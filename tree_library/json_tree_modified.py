@@ -8,6 +8,10 @@ Log: Added labels to the skeleton tree
 
 import json
 import csv
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from tree_library.tree_diff import build_hash_tree, save_snapshot
 
 FNAME_STRUCT = "structure"
 FNAME_DISPLAY = "struct_year_level"
@@ -18,6 +22,33 @@ IDX_CONTENT_TAG = -2
 IDX_YEAR_LEVEL = -1
 IDX_SUBTOPIC = 1
 
+# process pools of the library start spawned workers, which are safe to
+# start from threads, e.g. in the local service
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+
+class TreeRows(list):
+    ''' rows of the tree design file that keep the header, so that
+    they can be used in place of a csv.DictReader.
+    '''
+    def __init__(self, rows, fieldnames):
+        super().__init__(rows)
+        self.fieldnames = fieldnames
+
+
+class TreeFile:
+    ''' rows of the tree design file that are read from the file again
+    every time they are iterated, so they are never all in memory.
+    '''
+    def __init__(self, fpath_tree):
+        self.fpath_tree = fpath_tree
+        with open(fpath_tree, 'r', encoding='utf-8') as csvf:
+            self.fieldnames = csv.DictReader(csvf).fieldnames
+
+    def __iter__(self):
+        with open(self.fpath_tree, 'r', encoding='utf-8') as csvf:
+            yield from csv.DictReader(csvf)
+
 
 def construct_json(data, depth):
     ''' construct a json file for the skeleton structure
@@ -53,83 +84,114 @@ def construct_json(data, depth):
     return output
 
 
-def construct_with_yl(data):
+def construct_with_yl(data, year_index=None):
     ''' construct a json file that documents and visualizes
     all content tags with the relevant year levels in
-    a hierachical structure. Input the rows of the csv file `data`
+    a hierachical structure. Input the rows of the csv file `data`.
+    If a dictionary `year_index` is given, it is filled with the
+    content tags and their ancestor nodes for each year level.
     '''
 
     output = {}
     all_fields = data.fieldnames
-    cur_idx = -1
-    dis_idx = 0
     # document all year levels for the first two level nodes
     year_level_dict = {"All levels": set()}
+    third_level_nodes = {}
 
     for row in data:
-        # track the position in the output dictionary
-        track = output
-        next_tag = row[all_fields[IDX_CONTENT_TAG]]
-        year_level = row[all_fields[IDX_YEAR_LEVEL]]
-        subtopic = row[all_fields[IDX_SUBTOPIC]]
-        entry = f"Y{year_level} {next_tag}"
-
-        # record year level for first two levels
-        if subtopic not in year_level_dict:
-            year_level_dict[subtopic] = set()
-        year_level_dict[subtopic].add(f"Y{year_level}")
-        year_level_dict['All levels'].add(f'Y{year_level}')
-
-        # construct first two levels of nodes
-        for i in range(DEPTH-2):
-            field = all_fields[i]
-            next_node = row[field]
-            if next_node not in track:
-                if i == 0:
-                    track[next_node] = {}
-                elif i == 1:
-                    track[next_node] = []
-                    cur_idx = -1
-            track = track[next_node]
-        
-        # construct the third level, which also includes content tags
-        field = all_fields[DEPTH-1]
+        record_year_level(year_level_dict, year_index, row, all_fields)
+        add_yl_row(output, third_level_nodes, row, all_fields)
+
+    summarize_year_levels(output, year_level_dict)
+    return output
+
+
+def construct_yl_nodes(data):
+    ''' construct the nodes of the struct file with year levels,
+    without the overall year level distribution.
+    '''
+    output = {}
+    third_level_nodes = {}
+    for row in data:
+        add_yl_row(output, third_level_nodes, row, data.fieldnames)
+
+    return output
+
+
+def record_year_level(year_level_dict, year_index, row, all_fields):
+    ''' record the year level of a row for the first two levels
+    and, if `year_index` is given, under the year level index.
+    '''
+    next_tag = row[all_fields[IDX_CONTENT_TAG]]
+    year_level = row[all_fields[IDX_YEAR_LEVEL]]
+    subtopic = row[all_fields[IDX_SUBTOPIC]]
+
+    # record year level for first two levels
+    if subtopic not in year_level_dict:
+        year_level_dict[subtopic] = set()
+    year_level_dict[subtopic].add(f"Y{year_level}")
+    year_level_dict['All levels'].add(f'Y{year_level}')
+
+    # record the content tag under its year level
+    if year_index is not None:
+        ancestors = tuple(row[field] for field in all_fields[:DEPTH])
+        year_index.setdefault(f"Y{year_level}", []).append((ancestors, next_tag))
+
+
+def add_yl_row(output, third_level_nodes, row, all_fields):
+    ''' add the nodes of one row to the struct file with year levels.
+    `third_level_nodes` keeps the third level nodes that have been added
+    by their ancestors, so they are found without scanning the list.
+    '''
+    # track the position in the output dictionary
+    track = output
+    next_tag = row[all_fields[IDX_CONTENT_TAG]]
+    year_level = row[all_fields[IDX_YEAR_LEVEL]]
+    entry = f"Y{year_level} {next_tag}"
+
+    # construct first two levels of nodes
+    for i in range(DEPTH-2):
+        field = all_fields[i]
         next_node = row[field]
-        node_exists = False
-        for i in range(len(track)):
-            node = track[i]
-            if next_node in node:
-                cur_idx = i
-                node_exists = True
-
-        if not node_exists:
-            temp_cont = {next_node: {}}
-            track.append(temp_cont)
-            cur_idx = len(track) - 1
-
-        track = track[cur_idx]
-        dis_idx = len(track)
-        track[dis_idx] = entry
-
-        # construct last level of nodes with the relevant tag index
+        if next_node not in track:
+            if i == 0:
+                track[next_node] = {}
+            elif i == 1:
+                track[next_node] = []
         track = track[next_node]
-        field = all_fields[DEPTH]
-        next_node = row[field]
 
-        if next_node not in track:
-            track[next_node] = f"{dis_idx}"
-        else:
-            track[next_node] += f" {dis_idx}"
-        dis_idx += 1
+    # construct the third level, which also includes content tags
+    field = all_fields[DEPTH-1]
+    next_node = row[field]
+    key = (row[all_fields[0]], row[all_fields[1]], next_node)
+
+    if key not in third_level_nodes:
+        third_level_nodes[key] = {next_node: {}}
+        track.append(third_level_nodes[key])
+
+    track = third_level_nodes[key]
+    dis_idx = len(track)
+    track[dis_idx] = entry
+
+    # construct last level of nodes with the relevant tag index
+    track = track[next_node]
+    field = all_fields[DEPTH]
+    next_node = row[field]
+
+    if next_node not in track:
+        track[next_node] = f"{dis_idx}"
+    else:
+        track[next_node] += f" {dis_idx}"
+
 
-    # report the overall year level distribution
+def summarize_year_levels(output, year_level_dict):
+    ''' report the overall year level distribution
+    '''
     track = output
     for key, val in year_level_dict.items():
         sorted_val = sorted(list(val))
         track[key] = ' '.join(sorted_val)
 
-    return output
-
 
 def detailed_tree(data, depth):
     ''' construct a json file for the knowledge that
@@ -161,6 +223,68 @@ def detailed_tree(data, depth):
     return output
 
 
+def filter_year_level(year_index, year_level):
+    ''' construct the detailed tree for only one year level,
+    e.g. "Y9", using the index filled by construct_with_yl.
+    '''
+    output = {}
+
+    for ancestors, content_tag in year_index.get(year_level, []):
+        track = output
+        for node in ancestors:
+            if node not in track:
+                track[node] = {}
+            track = track[node]
+
+        if year_level not in track:
+            track[year_level] = []
+        track[year_level].append(content_tag)
+
+    return output
+
+
+def read_tree_rows(fpath_tree):
+    ''' read all the rows of the tree design file at once.
+    '''
+    with open(fpath_tree, 'r', encoding='utf-8') as csvf:
+
+        csvReader = csv.DictReader(csvf)
+        return TreeRows(csvReader, csvReader.fieldnames)
+
+
+def build_shard(rows):
+    ''' build the three JSON structures for the rows of one area.
+    '''
+    return (construct_json(rows, DEPTH), construct_yl_nodes(rows), detailed_tree(rows, DEPTH))
+
+
+def construct_sharded(rows, year_index=None, processes=None):
+    ''' construct the three JSON structures with each top level area
+    built in its own process. Areas keep the order of their first row
+    and the rows of an area keep their original order, so the merged
+    structures are the same as the ones built in one go.
+    '''
+    fields = rows.fieldnames
+    shards = {}
+    for row in rows:
+        shards.setdefault(row[fields[0]], TreeRows([], fields)).append(row)
+
+    struct_json, struct_with_tag_json, detailed_tree_json = {}, {}, {}
+    with ProcessPoolExecutor(max_workers=processes, mp_context=POOL_CONTEXT) as executor:
+        for struct, struct_with_tag, detailed in executor.map(build_shard, shards.values()):
+            struct_json.update(struct)
+            struct_with_tag_json.update(struct_with_tag)
+            detailed_tree_json.update(detailed)
+
+    # the year level distribution covers all areas
+    year_level_dict = {"All levels": set()}
+    for row in rows:
+        record_year_level(year_level_dict, year_index, row, fields)
+    summarize_year_levels(struct_with_tag_json, year_level_dict)
+
+    return struct_json, struct_with_tag_json, detailed_tree_json
+
+
 def add_label(data):
     """ Add serial number labels to the displayed version for nodes.
     """
@@ -204,32 +328,60 @@ def write_json(data, fname):
     and a specified filename `fname`.
     '''
     with open(f"{fname}.json", 'w', encoding='utf-8') as jsonf:
-        jsonf.write(json.dumps(data, indent=4))
+        json.dump(data, jsonf, indent=4)
 
 
-def create_json_tree(fpath_tree, fpath_output):
-    """ driver program for all the JSON tree files
+def get_file_name(year_level, used_names):
+    ''' turn a year level into a part of a file name that is safe on any
+    system, e.g. "Y7/8" becomes "Y7_8". Year levels that end up with the
+    same name are numbered.
+    '''
+    name = re.sub(r'[^A-Za-z0-9_-]+', '_', year_level).strip('_') or "Y"
+    unique_name = name
+    count = 2
+    while unique_name.lower() in used_names:
+        unique_name = f"{name}_{count}"
+        count += 1
+
+    used_names.add(unique_name.lower())
+    return unique_name
+
+
+def write_json_tree(rows, fpath_output, split_years=False, sharded=False):
+    """ produce all the JSON tree files from the rows of the tree design
+    file. If `split_years` is set, a detailed tree is also produced for
+    each year level. If `sharded` is set, the top level areas are built
+    in parallel.
     """
+    year_index = {} if split_years else None
 
-    # read the json tree design file and provide struct.json
-    with open(fpath_tree, 'r', encoding='utf-8') as csvf:
-
-        csvReader = csv.DictReader(csvf)
-        struct_json = construct_json(csvReader, DEPTH)
-        labeled_json = add_label(struct_json)
-        write_json(labeled_json, f"{fpath_output}/{FNAME_STRUCT}")
-
-    # provide the struct file with year levels
-    with open(fpath_tree, 'r', encoding='utf-8') as csvf:
-
-        csvReader = csv.DictReader(csvf)
-        struct_with_tag_json = construct_with_yl(csvReader)
+    # provide struct.json, the struct file with year levels and detailed_tree.json,
+    # each one is written before the next is built unless built in parallel
+    if sharded:
+        struct_json, struct_with_tag_json, detailed_tree_json = construct_sharded(rows, year_index)
+        write_json(add_label(struct_json), f"{fpath_output}/{FNAME_STRUCT}")
         write_json(struct_with_tag_json, f"{fpath_output}/{FNAME_DISPLAY}")
+        write_json(detailed_tree_json, f"{fpath_output}/{FNAME_PROCESS}")
+    else:
+        write_json(add_label(construct_json(rows, DEPTH)), f"{fpath_output}/{FNAME_STRUCT}")
+        write_json(construct_with_yl(rows, year_index), f"{fpath_output}/{FNAME_DISPLAY}")
+        write_json(detailed_tree(rows, DEPTH), f"{fpath_output}/{FNAME_PROCESS}")
 
-    # provide detailed_tree.json
-    with open(fpath_tree, 'r', encoding='utf-8') as csvf:
+    # provide tree_hashes.json for comparing versions of the tree
+    save_snapshot(build_hash_tree(rows), fpath_output)
 
-        csvReader = csv.DictReader(csvf)
-        detailed_tree_json = detailed_tree(csvReader, DEPTH)
-        write_json(detailed_tree_json, f"{fpath_output}/{FNAME_PROCESS}")
+    # provide detailed_tree_Y*.json for each year level
+    if split_years:
+        used_names = set()
+        for year_level in year_index:
+            year_json = filter_year_level(year_index, year_level)
+            year_name = get_file_name(year_level, used_names)
+            write_json(year_json, f"{fpath_output}/{FNAME_PROCESS}_{year_name}")
 
+
+def create_json_tree(fpath_tree, fpath_output, split_years=False, sharded=False):
+    """ driver program for all the JSON tree files. The file is streamed
+    once for each output unless the areas are built in parallel.
+    """
+    rows = read_tree_rows(fpath_tree) if sharded else TreeFile(fpath_tree)
+    write_json_tree(rows, fpath_output, split_years, sharded)
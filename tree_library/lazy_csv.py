@@ -0,0 +1,143 @@
+"""
+This program provides a reader for very large csv files. The file
+is memory mapped and only the offsets of the rows are kept, so rows
+can be read by their number and only the requested columns of a row
+are decoded.
+Author: Yi Ding
+Version: 1.0
+"""
+
+import csv
+import io
+import mmap
+from array import array
+
+ENCODING = 'utf-8'
+QUOTE = b'"'
+DELIMITER = b','
+LINE_BREAKS = b'\r\n'
+
+
+class LazyCSV:
+    """ memory mapped csv file with a header row. Use it as a context
+    manager so that the file is closed afterwards.
+    """
+
+    def __init__(self, fpath):
+        self.file = open(fpath, 'rb')
+        self.data = b''
+        try:
+            if self.file.seek(0, io.SEEK_END):
+                self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.offsets = index_rows(self.data)
+            self.fieldnames = self.read_fields(0) if len(self.offsets) > 1 else []
+            self.columns = {name: i for i, name in enumerate(self.fieldnames)}
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """ number of rows, not counting the header
+        """
+        return max(len(self.offsets) - 2, 0)
+
+    def close(self):
+        if not isinstance(self.data, bytes):
+            self.data.close()
+        self.file.close()
+
+    def read_fields(self, row_idx, positions=None):
+        """ decode the fields at `positions` (all fields if None) of a
+        row, where row 0 is the header.
+        """
+        raw = self.data[self.offsets[row_idx]:self.offsets[row_idx + 1]]
+
+        # without quotes the fields can be split before anything is decoded
+        if QUOTE not in raw:
+            fields = raw.rstrip(LINE_BREAKS).split(DELIMITER)
+            if positions is None:
+                return [field.decode(ENCODING) for field in fields]
+            return [fields[i].decode(ENCODING) if i < len(fields) else None for i in positions]
+
+        # line breaks inside quotes become '\n', the same as reading the file in text mode.
+        # The row is not stripped, as its last line breaks may be inside a quote
+        fields = next(csv.reader(io.StringIO(raw.decode(ENCODING), newline=None)))
+        if positions is None:
+            return fields
+        return [fields[i] if i < len(fields) else None for i in positions]
+
+    def get_row(self, row_num, columns=None):
+        """ return the requested columns of data row `row_num` (starting
+        at 0) as a dictionary, like a row of csv.DictReader.
+        """
+        if not 0 <= row_num < len(self):
+            raise IndexError(f"row {row_num} out of range")
+
+        columns = self.fieldnames if columns is None else columns
+        positions = [self.columns[name] for name in columns]
+        return dict(zip(columns, self.read_fields(row_num + 1, positions)))
+
+    def iter_columns(self, columns):
+        """ go through all data rows and yield a tuple with the values of
+        the requested columns.
+        """
+        positions = [self.columns[name] for name in columns]
+        for row_idx in range(1, len(self.offsets) - 1):
+            yield tuple(self.read_fields(row_idx, positions))
+
+
+def index_rows(data):
+    """ find the offset at which every row starts, followed by the end
+    of the data. Rows end at '\n', '\r\n' or a lone '\r' like in
+    csv.DictReader, but not inside fields that start with a quote.
+    Blank lines are skipped like csv.DictReader does.
+    """
+    offsets = array('q')
+    size = len(data)
+    start = 0
+    pos = 0
+
+    # the next of each character, kept until it has been passed so that
+    # each character is searched for once over the whole file
+    next_found = {b'\n': -1, b'\r': -1, QUOTE: -1}
+
+    def find_next(char):
+        if next_found[char] < pos:
+            found = data.find(char, pos)
+            next_found[char] = size if found == -1 else found
+        return next_found[char]
+
+    while pos < size:
+        end = min(find_next(b'\n'), find_next(b'\r'))
+
+        # a quote at the start of a field opens it up to its closing
+        # quote, where a doubled quote is an escaped one. Like the csv
+        # module, a quote anywhere else is an ordinary character.
+        quote = find_next(QUOTE)
+        if quote < end and (quote == start or data[quote - 1:quote] == DELIMITER):
+            closing = data.find(QUOTE, quote + 1)
+            while closing != -1 and data[closing + 1:closing + 2] == QUOTE:
+                closing = data.find(QUOTE, closing + 2)
+            pos = size if closing == -1 else closing + 1
+            continue
+        if quote < end:
+            pos = quote + 1
+            continue
+
+        end += 2 if data[end:end + 2] == b'\r\n' else 1
+        end = min(end, size)
+        if data[start:end].strip(LINE_BREAKS):
+            offsets.append(start)
+        start = pos = end
+
+    if start < size and data[start:size].strip(LINE_BREAKS):
+        offsets.append(start)
+    offsets.append(size)
+    return offsets
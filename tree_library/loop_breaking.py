@@ -0,0 +1,99 @@
+"""
+This program suggests a small set of low weight links whose removal
+breaks every loop found in the node linkages.
+Author: Yi Ding
+Version: 1.0
+"""
+
+import heapq
+
+
+def get_loop_links(loop, link_weights):
+    """ return the links (from_node, to_node) that form part of a loop.
+    A loop is searched from a node to its prerequisites, so every step
+    from `a` to `b` in the loop is the link from `b` to `a`.
+    """
+    links = set()
+    for i, node in enumerate(loop):
+        next_node = loop[(i + 1) % len(loop)]
+        if (next_node, node) in link_weights:
+            links.add((next_node, node))
+
+    return links
+
+
+def group_loops(loop_links):
+    """ split the loops into groups that share no links, so each
+    group can be broken on its own.
+    """
+    parent = list(range(len(loop_links)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    owner = {}
+    for i, links in enumerate(loop_links):
+        for link in links:
+            if link in owner:
+                parent[find(i)] = find(owner[link])
+            else:
+                owner[link] = i
+
+    groups = {}
+    for i in range(len(loop_links)):
+        groups.setdefault(find(i), []).append(i)
+
+    return list(groups.values())
+
+
+def break_group(group, loop_links, link_weights):
+    """ greedy weighted cover of one group of loops. The link with the
+    lowest weight per unbroken loop is removed first. Link counts only
+    go down, so a heap with lazy updates gives the same choices as
+    recomputing every link after each removal.
+    """
+    loops_of = {}
+    for i in group:
+        for link in loop_links[i]:
+            loops_of.setdefault(link, set()).add(i)
+
+    heap = [(link_weights[link] / len(loops), -len(loops), link) for link, loops in loops_of.items()]
+    heapq.heapify(heap)
+    unbroken = set(group)
+    removals = []
+
+    while unbroken and heap:
+        _, neg_count, link = heapq.heappop(heap)
+        broken = loops_of[link] & unbroken
+        if not broken:
+            continue
+
+        # the count is out of date, put the link back with its new ratio
+        if len(broken) != -neg_count:
+            heapq.heappush(heap, (link_weights[link] / len(broken), -len(broken), link))
+            continue
+
+        removals.append((link, len(broken)))
+        unbroken -= broken
+
+    return removals
+
+
+def suggest_removals(invalid_paths, link_weights):
+    """ suggest the links to remove so that all loops are broken. Return
+    a list of (from_node, to_node, weight, number of loops broken), and
+    the number of loops that contain no links and cannot be broken.
+    """
+    loop_links = [get_loop_links(loop, link_weights) for loop in invalid_paths]
+    n_unbreakable = sum(1 for links in loop_links if not links)
+    suggestions = []
+
+    for group in group_loops(loop_links):
+        group = [i for i in group if loop_links[i]]
+        for (from_node, to_node), n_broken in break_group(group, loop_links, link_weights):
+            suggestions.append((from_node, to_node, link_weights[(from_node, to_node)], n_broken))
+
+    return suggestions, n_unbreakable
@@ -7,6 +7,15 @@ Version: 1.0
 """
 
 import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from tree_library.lazy_csv import LazyCSV
+from tree_library.json_tree_modified import POOL_CONTEXT
+from tree_library.reachability import build_reachability, save_reachability
+from tree_library.node_lookup import build_name_index, suggest_names
+from tree_library.loop_breaking import suggest_removals
+from tree_library.prerequisite_paths import create_path_engine, precompute_paths, save_paths
 
 DEPTH = 4
 HOME_DEPTH = 1
@@ -18,9 +27,17 @@ STRLNK = "Option 2"
 FNAME_REP = "node_validation_report.txt"
 FNAME_LNK = "converted_to_string.csv"
 N_LENGTH = 100
+CHUNK_SIZE = 10000
+NAN = float('nan')
+PARALLEL_MIN_PATHS = 2000  # searches with fewer planned paths stay in one process
+SPLIT_DEPTH = 3  # length of the paths handed to the worker processes
+CHUNKS_PER_WORKER = 4  # chunks of planned paths handed to each worker
 
+search_graph = {}  # the graph searched by a worker process
 
-def generate_report(method, invalid_nodes, invalid_weight, invalid_paths, fpath_output):
+
+def generate_report(method, invalid_nodes, name_suggestions, invalid_weight, duplicate_links,
+                    self_links, invalid_paths, removals, fpath_output):
     """ outputs a .txt report that explains all the errors in the node links file
     """
     
@@ -39,6 +56,8 @@ def generate_report(method, invalid_nodes, invalid_weight, invalid_paths, fpath_
         f.write("from_node   to_node     weight" + '\n')
         for node in invalid_nodes:
             f.write("{:<11s} {:<11s} {}".format(node[start_idx], node[start_idx+1], node[start_idx+2]) + '\n')
+            for name, candidates in name_suggestions.get(node, []):
+                f.write(f"{'':7s}{name} --> did you mean: {', '.join(candidates)}" + '\n')
     else:
         f.write("All nodes seem to be valid." + '\n')
     
@@ -51,6 +70,26 @@ def generate_report(method, invalid_nodes, invalid_weight, invalid_paths, fpath_
             f.write("{:<11s} {:<11s} {}".format(node[start_idx], node[start_idx+1], node[start_idx+2]) + '\n')
     else:
         f.write("All weightings seem to be valid." + '\n')
+
+    # output the links that were given more than once
+    f.write('-'*N_LENGTH + '\n')
+    if duplicate_links:
+        f.write(f"{len(duplicate_links)} links were duplicated." + '\n')
+        f.write("from_node   to_node     weight" + '\n')
+        for node in duplicate_links:
+            f.write("{:<11s} {:<11s} {}".format(node[start_idx], node[start_idx+1], node[start_idx+2]) + '\n')
+    else:
+        f.write("No duplicated links were found." + '\n')
+
+    # output the links from a node to itself
+    f.write('-'*N_LENGTH + '\n')
+    if self_links:
+        f.write(f"{len(self_links)} nodes were linked to themselves." + '\n')
+        f.write("from_node   to_node     weight" + '\n')
+        for node in self_links:
+            f.write("{:<11s} {:<11s} {}".format(node[start_idx], node[start_idx+1], node[start_idx+2]) + '\n')
+    else:
+        f.write("No nodes were linked to themselves." + '\n')
     
     # output the loops found
     f.write('-'*N_LENGTH + '\n')
@@ -64,62 +103,120 @@ def generate_report(method, invalid_nodes, invalid_weight, invalid_paths, fpath_
                 f.write(f"{'':7s}{node}" + '\n')
     else:
         f.write("There does not seem to be loops." + '\n')
+
+    # output the links suggested for removal to break the loops
+    suggestions, n_unbreakable = removals
+    if invalid_paths:
+        f.write('-'*N_LENGTH + '\n')
+        f.write(f"Suggested removals: {len(suggestions)} links break the loops." + '\n')
+        f.write("from_node   to_node     weight      loops" + '\n')
+        for from_node, to_node, weight, n_broken in suggestions:
+            f.write("{:<11s} {:<11s} {:<11} {}".format(from_node[0], to_node[0], weight, n_broken) + '\n')
+        if n_unbreakable:
+            f.write(f"{n_unbreakable} loops do not contain any links and cannot be broken." + '\n')
     f.close()
 
 
-def convert_serial_to_string(fpath_link, linkages, all_nodes_down):
+def read_link_chunks(fpath_link):
+    """ read the linkage file in chunks of rows. Yield the rows
+    of each chunk together with the same rows stored as columns.
+    """
+    with open(fpath_link, 'r', encoding='utf-8') as csvf:
+
+        csvReader = csv.reader(csvf)
+        next(csvReader, None)
+        while True:
+            chunk = list(islice(csvReader, CHUNK_SIZE))
+            if not chunk:
+                break
+
+            # a chunk of only blank rows does not end the file
+            rows = [tuple(row) for row in chunk if row]
+            if rows:
+                yield rows, list(zip(*rows))
+
+
+def to_float(value):
+    """ convert a string to float, anything unreadable becomes nan
+    so that it fails every range check.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return NAN
+
+
+def check_weight_column(weights):
+    """ range check a whole column of weightings at once, return
+    whether each weighting is within (0,1].
+    """
+    return [0 < weight <= 1 for weight in map(to_float, weights)]
+
+
+def store_link(row, from_node, to_node, entry, weight, linkages, link_checks):
+    """ add a valid link to the linkages and keep its weighting, unless
+    it links a node to itself or has been given before.
+    """
+    if from_node == to_node:
+        link_checks['self'].append(row)
+    elif (from_node, to_node) in link_checks['seen']:
+        link_checks['duplicate'].append(row)
+    else:
+        link_checks['seen'].add((from_node, to_node))
+        link_checks['weights'][(from_node, to_node)] = to_float(weight)
+        if to_node not in linkages:
+            linkages[to_node] = []
+        linkages[to_node].append(entry)
+
+
+def convert_serial_to_string(fpath_link, linkages, all_nodes_down, link_weights=None):
     """ This function produces a linkage dictionary structure based
     on the given serial number file. Return the list of nodes with
-    invalid names and list of nodes with invalid weightings.
+    invalid names, nodes with invalid weightings, duplicated links
+    and links from a node to itself. The weighting of each valid link
+    is stored in `link_weights` if it is given.
     """
     invalid_nodes = []
     invalid_weight = []
+    link_weights = {} if link_weights is None else link_weights
+    link_checks = {'seen': set(), 'duplicate': [], 'self': [], 'weights': link_weights}
+    id_index = {val['id']: node for node, val in all_nodes_down.items()}
 
-    with open(fpath_link, 'r', encoding='utf-8') as csvf:
-
-        csvReader = csv.DictReader(csvf)
-        for row in csvReader:
+    for rows, (from_ids, to_ids, weights) in read_link_chunks(fpath_link):
 
-            # store linkages that are valid
-            from_node, to_node, weight = row.values()
-            is_valid = [False, False]
+        # range check for weighting and look up the serial numbers
+        valid_weight = check_weight_column(weights)
+        from_nodes = [id_index.get(x) for x in from_ids]
+        to_nodes = [id_index.get(x) for x in to_ids]
 
-            # range check for weighting
-            if float(weight) <= 0 or float(weight) > 1:
-                invalid_weight.append(tuple(row.values()))
+        for row, is_valid, from_node, to_node in zip(rows, valid_weight, from_nodes, to_nodes):
+            if not is_valid:
+                invalid_weight.append(row)
                 continue
 
-            # existence check for node serial number
-            for node, val in all_nodes_down.items():
-                if from_node == val['id']:
-                    from_node_mod = (node[0], weight)
-                    is_valid[0] = True
-                elif to_node == val['id']:
-                    to_node_mod = node
-                    is_valid[1] = True
-            
-            # store nodes with invalid names
-            if not is_valid[0] or not is_valid[1]:
-                invalid_nodes.append(tuple(row.values()))
+            # store nodes with invalid serial numbers
+            if from_node is None or to_node is None:
+                invalid_nodes.append(row)
                 continue
 
             # create the linkages dictionary structure
-            if to_node_mod not in linkages:
-                linkages[to_node_mod] = []
-            linkages[to_node_mod].append(from_node_mod)
-            
-    return invalid_nodes, invalid_weight
+            store_link(row, from_node, to_node, (from_node[0], row[2]), row[2], linkages, link_checks)
+
+    return invalid_nodes, invalid_weight, link_checks['duplicate'], link_checks['self']
 
 
 def linkage_struct_adjust(linkages):
     """ This function adjusts the linkage file for the
-    serial number method.
+    serial number method. Return the linkages for the loop
+    search, the given linkages keep their weightings.
     """
+    adjusted = {}
     for key, val in linkages.items():
         # change the value from weighting to depth
         depth = key[1]
-        temp = [(x[0], depth) for x in val]
-        linkages[key] = temp
+        adjusted[key] = [(x[0], depth) for x in val]
+
+    return adjusted
 
 
 def save_linkage(linkages, fpath_output):
@@ -187,9 +284,20 @@ def check_loop(next_node, current_path):
     return status, loop
 
 
+def get_next_nodes(node, linkages, all_nodes_down, all_nodes_up):
+    """ create a list of all nodes to search for after `node`
+    """
+    next_nodes = all_nodes_down[node]['children'] + all_nodes_up[node]['parent']
+    if node in linkages:
+        next_nodes += linkages[node]
+
+    return next_nodes
+
+
 def recursive_search_loop(invalid_paths, current_path, linkages,
-                    all_nodes_down, all_nodes_up, node_queue):
-    """ Recursively searches for any loops in the a path.
+                    all_nodes_down, all_nodes_up, visited):
+    """ Recursively searches for any loops in the a path. Every node
+    that is looked at is added to `visited`.
     """
     last_explored = current_path[-1]
 
@@ -197,17 +305,11 @@ def recursive_search_loop(invalid_paths, current_path, linkages,
     if last_explored[1] == HOME_DEPTH:
         return
 
-    # create a list of all nodes to search for
-    next_nodes = all_nodes_down[last_explored]['children'] + all_nodes_up[last_explored]['parent']
-    if last_explored in linkages:
-        next_nodes += linkages[last_explored]
-
-    for next_node in next_nodes:
+    for next_node in get_next_nodes(last_explored, linkages, all_nodes_down, all_nodes_up):
         # check whether a loop forms
         status, loop = check_loop(next_node, current_path)
-        if next_node in node_queue:
-            node_queue.remove(next_node)
-        
+        visited.add(next_node)
+
         # decide the action for the current path that is being searched
         if status == TERMINATE:
             continue
@@ -215,24 +317,60 @@ def recursive_search_loop(invalid_paths, current_path, linkages,
             invalid_paths.append(loop)
         if status == NO_LOOP:
             recursive_search_loop(invalid_paths, current_path + [next_node],
-                    linkages, all_nodes_down, all_nodes_up, node_queue)
+                    linkages, all_nodes_down, all_nodes_up, visited)
+
+
+def plan_search(plan, current_path, linkages, all_nodes_down, all_nodes_up, visited):
+    """ Same search as recursive_search_loop, but once a path is
+    SPLIT_DEPTH steps long the rest of it is left as a work unit.
+    `plan` receives ('loop', loop) and ('path', path) in search order.
+    """
+    last_explored = current_path[-1]
+    if last_explored[1] == HOME_DEPTH:
+        return
+
+    for next_node in get_next_nodes(last_explored, linkages, all_nodes_down, all_nodes_up):
+        status, loop = check_loop(next_node, current_path)
+        visited.add(next_node)
+
+        if status == HAS_LOOP:
+            plan.append(('loop', loop))
+        elif status == NO_LOOP and len(current_path) < SPLIT_DEPTH:
+            plan_search(plan, current_path + [next_node], linkages, all_nodes_down, all_nodes_up, visited)
+        elif status == NO_LOOP:
+            plan.append(('path', current_path + [next_node]))
+
+
+def init_search(linkages, all_nodes_down, all_nodes_up):
+    """ give each worker process its own copy of the graph once
+    """
+    search_graph['linkages'] = linkages
+    search_graph['all_nodes_down'] = all_nodes_down
+    search_graph['all_nodes_up'] = all_nodes_up
+
+
+def search_path(current_path):
+    """ work unit: find the loops below one path. Return the loops
+    and the nodes that were looked at.
+    """
+    return search_path_in(current_path, search_graph['linkages'],
+                          search_graph['all_nodes_down'], search_graph['all_nodes_up'])
 
 
 def get_nodes(fpath_tree, all_nodes_down, all_nodes_up):
     """ gets all the parent, children node relationships based
     on the a given tree design file
     """
-    with open(fpath_tree, 'r', encoding='utf-8') as csvf:
+    with LazyCSV(fpath_tree) as csv_data:
         id_lst = [1 for _ in range(DEPTH)]
-        csvReader = csv.DictReader(csvf)
-        fields = csvReader.fieldnames
-        
+        known_children = set()
+
         # create a dictionary of parent: children relationship
-        for row in csvReader:
+        for row in csv_data.iter_columns(csv_data.fieldnames[:DEPTH]):
             for i in range(DEPTH):
-                from_node = (row[fields[i]], i+1)
+                from_node = (row[i], i+1)
                 if i < DEPTH - 1:
-                    to_node = (row[fields[i+1]], i+2)
+                    to_node = (row[i+1], i+2)
                 else:
                     to_node = None
 
@@ -245,7 +383,8 @@ def get_nodes(fpath_tree, all_nodes_down, all_nodes_up):
                     id_lst[i] += 1
 
                 # allocate child node
-                if to_node and to_node not in all_nodes_down[from_node]['children']:
+                if to_node and (from_node, to_node) not in known_children:
+                    known_children.add((from_node, to_node))
                     all_nodes_down[from_node]['children'].append(to_node)
 
         # reverse the all nodes down to create a dictionary of child: parent relationship
@@ -257,87 +396,209 @@ def get_nodes(fpath_tree, all_nodes_down, all_nodes_up):
                 }
 
 
-def get_str_link(fpath_link, linkages, all_nodes_down):
+def get_str_link(fpath_link, linkages, all_nodes_down, link_weights=None):
     """ This function extracts the linkages from the given
     written string linkage file and then return the pairs
-    of nodes with invalid names or weightings.
+    of nodes with invalid names or weightings, duplicated links
+    and links from a node to itself. The weighting of each valid
+    link is stored in `link_weights` if it is given.
     """
-    with open(fpath_link, 'r', encoding='utf-8') as csvf:
+    invalid_nodes = []
+    invalid_weight = []
+    link_weights = {} if link_weights is None else link_weights
+    link_checks = {'seen': set(), 'duplicate': [], 'self': [], 'weights': link_weights}
 
-        invalid_nodes = []
-        invalid_weight = []
-        csvReader = csv.DictReader(csvf)
+    for rows, (depths, from_names, to_names, weights) in read_link_chunks(fpath_link):
 
-        for row in csvReader:
-            depth, from_node, to_node, weight = row.values()
-            is_valid = True
+        # range check for weighting and existence check for node names
+        valid_weight = check_weight_column(weights)
+        depths = [int(x) if x.strip().isdigit() else None for x in depths]
+        from_nodes = [(x, d) if (x, d) in all_nodes_down else None for x, d in zip(from_names, depths)]
+        to_nodes = [(x, d) if (x, d) in all_nodes_down else None for x, d in zip(to_names, depths)]
 
-            # range check for weighting
-            if float(weight) <= 0 or float(weight) > 1:
-                invalid_weight.append(tuple(row.values()))
+        for row, is_valid, from_node, to_node in zip(rows, valid_weight, from_nodes, to_nodes):
+            if not is_valid:
+                invalid_weight.append(row)
+            if from_node is None or to_node is None:
+                invalid_nodes.append(row)
                 is_valid = False
 
-            # existence check for node names
-            from_node_mod = (from_node, int(depth))
-            to_node_mod = (to_node, int(depth))
-            if from_node_mod not in all_nodes_down or to_node_mod not in all_nodes_down:
-                invalid_nodes.append(tuple(row.values()))
-                is_valid = False
-            
             # skip the linkage construction if validity is false
             if not is_valid:
                 continue
-            
+
             # store the new linkages
-            if to_node_mod not in linkages:
-                linkages[to_node_mod] = []
-            linkages[to_node_mod].append(from_node_mod)
-    
-    return invalid_nodes, invalid_weight
+            store_link(row, from_node, to_node, from_node, row[3], linkages, link_checks)
+
+    return invalid_nodes, invalid_weight, link_checks['duplicate'], link_checks['self']
 
 
-def validate_linkage(linkages, all_nodes_down, all_nodes_up):
+def suggest_node_names(invalid_nodes, all_nodes_down):
+    """ find the closest node names for the names in the written
+    string linkage file that were not found in the tree. A row that
+    appears several times is looked up once.
+    """
+    name_suggestions = {}
+    name_index = build_name_index(all_nodes_down)
+    seen = set()
+
+    for row in invalid_nodes:
+        depth, from_node, to_node = row[:3]
+        if row in seen or not depth.strip().isdigit():
+            continue
+        seen.add(row)
+        for name in (from_node, to_node):
+            if (name, int(depth)) in all_nodes_down:
+                continue
+            candidates = suggest_names(name_index, name, int(depth))
+            if candidates:
+                name_suggestions.setdefault(row, []).append((name, candidates))
+
+    return name_suggestions
+
+
+def search_path_in(current_path, linkages, all_nodes_down, all_nodes_up):
+    """ find the loops below one path. Return the loops and the nodes
+    that were looked at.
+    """
+    invalid_paths = []
+    visited = set()
+    recursive_search_loop(invalid_paths, current_path, linkages,
+                          all_nodes_down, all_nodes_up, visited)
+
+    return invalid_paths, visited
+
+
+def merge_plan(plan, results, invalid_paths, visited):
+    """ put the loops of a planned search in search order, taking the
+    result of each planned path from `results` in turn
+    """
+    for kind, item in plan:
+        if kind == 'loop':
+            invalid_paths.append(item)
+        else:
+            loops, path_visited = next(results)
+            invalid_paths += loops
+            visited |= path_visited
+
+
+def validate_linkage(linkages, all_nodes_down, all_nodes_up, processes=None):
     """ This funciton validates all the linkages by finding loops
-    and then return a list of paths that create loops.
+    and then return a list of paths that create loops. With several
+    CPUs and `processes` not 1, a search from one node that plans at
+    least PARALLEL_MIN_PATHS paths is run on a process pool. The loops
+    come out in the same order as a search in one process.
     """
     invalid_paths = []
     node_queue = [x for x in linkages]
+    visited = set()
+    workers = processes or os.cpu_count() or 1
+    parallel = processes != 1 and (os.cpu_count() or 1) > 1
+    executor = None
+
+    try:
+        # inspect all the nodes that could form loops, skipping the ones already looked at
+        while (node_queue):
+            current_path = [node_queue.pop()]
+            if current_path[0] in visited:
+                continue
+            if not parallel:
+                recursive_search_loop(invalid_paths, current_path, linkages,
+                                all_nodes_down, all_nodes_up, visited)
+                continue
 
-    # inspect all the nodes that could form loops
-    while (node_queue):
-        current_path = [node_queue.pop()]
-        recursive_search_loop(invalid_paths, current_path, linkages,
-                        all_nodes_down, all_nodes_up, node_queue)
+            # split the search from this node into paths, small searches stay in this process
+            plan = []
+            plan_search(plan, current_path, linkages, all_nodes_down, all_nodes_up, visited)
+            paths = [item for kind, item in plan if kind == 'path']
+            if len(paths) < PARALLEL_MIN_PATHS:
+                results = (search_path_in(path, linkages, all_nodes_down, all_nodes_up) for path in paths)
+            else:
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=workers,
+                                                   mp_context=POOL_CONTEXT,
+                                                   initializer=init_search,
+                                                   initargs=(linkages, all_nodes_down, all_nodes_up))
+                chunksize = max(1, len(paths) // (workers * CHUNKS_PER_WORKER))
+                results = executor.map(search_path, paths, chunksize=chunksize)
+
+            merge_plan(plan, results, invalid_paths, visited)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # filter out same paths
-    unique_sets = []
+    unique_sets = set()
     invalid_paths_cleaned = []
     for loop in invalid_paths:
-        if set(loop) not in unique_sets:
-            unique_sets.append(set(loop))
+        if frozenset(loop) not in unique_sets:
+            unique_sets.add(frozenset(loop))
             invalid_paths_cleaned.append(loop)
 
     return invalid_paths_cleaned
 
 
-def process_linkage(method, fpath_tree, fpath_link, fpath_output):
-    """ driver program for processing the node linkage files
+def read_linkage(method, fpath_link, all_nodes_down):
+    """ read and validate the linkage file with the given method. Return
+    a dictionary with the linkages ready for loop checking, the weighting
+    of each link and the rows that were found to be invalid.
     """
-
-    all_nodes_down = {}
-    all_nodes_up = {}
     linkages = {}
-    get_nodes(fpath_tree, all_nodes_down, all_nodes_up)
+    link_data = {'linkages': linkages, 'converted': None, 'link_weights': {}}
 
     # if serial number is used, conversion of linkage file would be required
     if method == SERNUM:
-        invalid_nodes, invalid_weight = convert_serial_to_string(fpath_link, linkages, all_nodes_down)
-        save_linkage(linkages, fpath_output)
-        linkage_struct_adjust(linkages)
+        results = convert_serial_to_string(fpath_link, linkages, all_nodes_down, link_data['link_weights'])
+        link_data['converted'] = linkages
+        link_data['linkages'] = linkage_struct_adjust(linkages)
+    elif method == STRLNK:
+        results = get_str_link(fpath_link, linkages, all_nodes_down, link_data['link_weights'])
+
+    for key, result in zip(['invalid_nodes', 'invalid_weight', 'duplicate_links', 'self_links'], results):
+        link_data[key] = result
+
+    return link_data
+
+
+def check_linkage(method, link_data, all_nodes_down, all_nodes_up, fpath_output, path_targets=None):
+    """ find the loops in the linkages that were read and produce
+    all the output files. The given structures are not modified.
+    If `path_targets` are given, the strongest prerequisite chains
+    to each of these nodes are saved as well.
+    """
+    linkages = link_data['linkages']
+    name_suggestions = {}
+    if method == SERNUM:
+        save_linkage(link_data['converted'], fpath_output)
     elif method == STRLNK:
-        invalid_nodes, invalid_weight = get_str_link(fpath_link, linkages, all_nodes_down)
+        name_suggestions = suggest_node_names(link_data['invalid_nodes'], all_nodes_down)
 
-    # find loops and produce a report showing all errors
+    # find loops, suggest how to break them and produce a report showing all errors
     invalid_paths = validate_linkage(linkages, all_nodes_down, all_nodes_up)
-    generate_report(method, invalid_nodes, invalid_weight, invalid_paths, fpath_output)
+    removals = suggest_removals(invalid_paths, link_data['link_weights'])
+    generate_report(method, link_data['invalid_nodes'], name_suggestions, link_data['invalid_weight'],
+                    link_data['duplicate_links'], link_data['self_links'], invalid_paths, removals,
+                    fpath_output)
+
+    # keep the linkage graph as an index for prerequisite queries
+    reach_index = build_reachability(linkages, all_nodes_down)
+    save_reachability(reach_index, fpath_output)
+
+    # batch mode of the strongest prerequisite chains over the weighted links
+    if path_targets:
+        engine = create_path_engine(link_data['link_weights'])
+        save_paths(precompute_paths(engine, path_targets), fpath_output)
+
+
+def process_linkage(method, fpath_tree, fpath_link, fpath_output, path_targets=None):
+    """ driver program for processing the node linkage files. `path_targets`
+    are the (name, depth) nodes to precompute the strongest prerequisite
+    chains for.
+    """
+
+    all_nodes_down = {}
+    all_nodes_up = {}
+    get_nodes(fpath_tree, all_nodes_down, all_nodes_up)
 
+    link_data = read_linkage(method, fpath_link, all_nodes_down)
+    check_linkage(method, link_data, all_nodes_down, all_nodes_up, fpath_output, path_targets)
@@ -0,0 +1,119 @@
+"""
+This program builds a lookup index over the node names of the
+knowledge tree. It supports exact, prefix and typo tolerant
+lookups, which are used for "did you mean" suggestions and
+autocompletion of node names.
+Author: Yi Ding
+Version: 1.0
+"""
+
+END = ''  # key under which a trie node stores the names ending there
+MAX_TYPOS = 2
+N_SUGGESTIONS = 3
+
+
+def build_name_index(all_nodes_down):
+    """ create one trie per depth from the (name, depth) nodes of
+    the tree. Names are stored under their casefolded spelling.
+    """
+    index = {}
+
+    for name, depth in all_nodes_down:
+        track = index.setdefault(depth, {})
+        for char in name.casefold():
+            track = track.setdefault(char, {})
+        names = track.setdefault(END, [])
+        if name not in names:
+            names.append(name)
+
+    return index
+
+
+def find_trie_node(index, prefix, depth):
+    """ return the trie node reached by `prefix`, or None.
+    """
+    track = index.get(depth)
+    for char in prefix.casefold():
+        if track is None:
+            return None
+        track = track.get(char)
+
+    return track
+
+
+def collect_names(track, limit):
+    """ collect the names stored below a trie node, shorter names first.
+    """
+    names = []
+    level = [track]
+
+    # breadth first so the closest completions come out first
+    while level and len(names) < limit:
+        next_level = []
+        for node in level:
+            for char, child in sorted(node.items()):
+                if char == END:
+                    names += child
+                else:
+                    next_level.append(child)
+        level = next_level
+
+    return names[:limit]
+
+
+def lookup_exact(index, name, depth):
+    """ return the node names at `depth` that equal `name` ignoring case.
+    """
+    track = find_trie_node(index, name, depth)
+    if track is None:
+        return []
+
+    return list(track.get(END, []))
+
+
+def lookup_prefix(index, prefix, depth, limit=10):
+    """ return up to `limit` node names at `depth` starting with `prefix`,
+    to be used for autocompletion.
+    """
+    track = find_trie_node(index, prefix, depth)
+    if track is None:
+        return []
+
+    return collect_names(track, limit)
+
+
+def lookup_fuzzy(index, name, depth, max_typos=MAX_TYPOS):
+    """ return (distance, name) pairs for the node names at `depth` that
+    are within `max_typos` edits of `name`, closest first. Branches of
+    the trie are dropped as soon as they can no longer be within range.
+    """
+    query = name.casefold()
+    results = []
+    root = index.get(depth)
+    if root is None:
+        return results
+
+    # each stack entry holds a trie node and the last row of the edit distance table
+    stack = [(root, list(range(len(query) + 1)))]
+    while stack:
+        track, prev_row = stack.pop()
+        if END in track and prev_row[-1] <= max_typos:
+            results += [(prev_row[-1], node) for node in track[END]]
+
+        for char, child in track.items():
+            if char == END:
+                continue
+            row = [prev_row[0] + 1]
+            for i in range(1, len(query) + 1):
+                cost = 0 if query[i - 1] == char else 1
+                row.append(min(row[i - 1] + 1, prev_row[i] + 1, prev_row[i - 1] + cost))
+            if min(row) <= max_typos:
+                stack.append((child, row))
+
+    return sorted(results)
+
+
+def suggest_names(index, name, depth, limit=N_SUGGESTIONS):
+    """ return the closest node names to a name that was not found.
+    """
+    return [node for _, node in lookup_fuzzy(index, name, depth)[:limit]]
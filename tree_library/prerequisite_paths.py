@@ -0,0 +1,135 @@
+"""
+This program finds the strongest prerequisite chain between two
+nodes over the weighted node linkages. The strength of a chain is
+the product of its link weights, which is found as the shortest
+path over -log(weight).
+Author: Yi Ding
+Version: 1.0
+"""
+
+import heapq
+import json
+import math
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = 128
+FNAME_PATHS = "prerequisite_paths"
+
+
+def create_path_engine(link_weights, cache_size=CACHE_SIZE):
+    """ create the query engine from the weighted links
+    {(from_node, to_node): weight}. Links point from a prerequisite
+    to the node it unlocks.
+    """
+    graph = {}
+    reverse_graph = {}
+    for (from_node, to_node), weight in link_weights.items():
+        cost = -math.log(weight)
+        graph.setdefault(from_node, []).append((to_node, cost))
+        reverse_graph.setdefault(to_node, []).append((from_node, cost))
+
+    return {
+        'graph': graph,
+        'reverse_graph': reverse_graph,
+        'cache': OrderedDict(),
+        'cache_size': cache_size,
+        'lock': threading.Lock()
+    }
+
+
+def search_paths(graph, source):
+    """ Dijkstra's algorithm from `source`. Return the lowest cost of
+    every reached node and the node it was reached from.
+    """
+    costs = {source: 0.0}
+    previous = {source: None}
+    heap = [(0.0, source)]
+
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > costs[node]:
+            continue
+        for next_node, link_cost in graph.get(node, []):
+            new_cost = cost + link_cost
+            if next_node not in costs or new_cost < costs[next_node]:
+                costs[next_node] = new_cost
+                previous[next_node] = node
+                heapq.heappush(heap, (new_cost, next_node))
+
+    return costs, previous
+
+
+def get_single_source(engine, source):
+    """ return the search result from `source`, using the cache and
+    evicting the least recently used result when it is full. The
+    engine can be shared by threads, e.g. in the local service.
+    """
+    cache = engine['cache']
+    with engine['lock']:
+        if source in cache:
+            cache.move_to_end(source)
+            return cache[source]
+
+    result = search_paths(engine['graph'], source)
+    with engine['lock']:
+        cache[source] = result
+        if len(cache) > engine['cache_size']:
+            cache.popitem(last=False)
+
+    return result
+
+
+def strongest_path(engine, source, target):
+    """ return the strongest prerequisite chain from `source` to `target`
+    as (strength, [source, ..., target]), or (0.0, []) if there is none.
+    """
+    costs, previous = get_single_source(engine, tuple(source))
+    target = tuple(target)
+    if target not in costs:
+        return 0.0, []
+
+    path = [target]
+    while previous[path[-1]] is not None:
+        path.append(previous[path[-1]])
+
+    return math.exp(-costs[target]), path[::-1]
+
+
+def precompute_paths(engine, targets):
+    """ batch mode: for each target node find the strongest chain from
+    every node that leads to it, searching backwards from the target once.
+    Return {target: {source: (strength, path)}}.
+    """
+    table = {}
+
+    for target in targets:
+        target = tuple(target)
+        costs, following = search_paths(engine['reverse_graph'], target)
+        table[target] = {}
+        for source, cost in costs.items():
+            if source == target:
+                continue
+            path = [source]
+            while following[path[-1]] is not None:
+                path.append(following[path[-1]])
+            table[target][source] = (math.exp(-cost), path)
+
+    return table
+
+
+def save_paths(table, fpath_output):
+    """ write the precomputed chains to a json file.
+    """
+    data = []
+    for target, sources in table.items():
+        for source, (strength, path) in sources.items():
+            data.append({
+                'from_node': list(source),
+                'to_node': list(target),
+                'strength': strength,
+                'path': [list(node) for node in path]
+            })
+
+    with open(f"{fpath_output}/{FNAME_PATHS}.json", 'w', encoding='utf-8') as jsonf:
+        jsonf.write(json.dumps(data, indent=4))
@@ -0,0 +1,214 @@
+"""
+This program builds a reachability index over the validated node
+linkages and the tree design, so that prerequisite queries can be
+answered without searching through the graph again.
+Author: Yi Ding
+Version: 1.0
+"""
+
+import json
+
+FNAME_REACH = "reachability_index"
+
+
+def build_graph(linkages, all_nodes_down):
+    """ number all the nodes and create the adjacency lists where
+    an edge points from a prerequisite to the node it unlocks.
+    Both parent --> child and from_node --> to_node are used.
+    """
+    nodes = list(all_nodes_down)
+    node_idx = {node: i for i, node in enumerate(nodes)}
+
+    # add the nodes that only appear in the linkages
+    for to_node, from_nodes in linkages.items():
+        for node in [to_node] + from_nodes:
+            if node not in node_idx:
+                node_idx[node] = len(nodes)
+                nodes.append(node)
+
+    successors = [[] for _ in nodes]
+    for node, val in all_nodes_down.items():
+        for child in val['children']:
+            successors[node_idx[node]].append(node_idx[child])
+    for to_node, from_nodes in linkages.items():
+        for from_node in from_nodes:
+            successors[node_idx[from_node]].append(node_idx[to_node])
+
+    return nodes, node_idx, successors
+
+
+def find_components(successors):
+    """ Tarjan's algorithm without recursion. Return the component
+    of each node and the list of components, which comes out in reverse
+    topological order (a component is listed after all it can reach).
+    """
+    n_nodes = len(successors)
+    index = [-1] * n_nodes
+    low = [0] * n_nodes
+    on_stack = [False] * n_nodes
+    comp_of = [-1] * n_nodes
+    components = []
+    stack = []
+    counter = 0
+
+    for root in range(n_nodes):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, pos = work.pop()
+
+            # first visit of the node
+            if pos == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+
+            # continue with the next unexplored successor
+            descended = False
+            while pos < len(successors[node]):
+                nxt = successors[node][pos]
+                pos += 1
+                if index[nxt] == -1:
+                    work.append((node, pos))
+                    work.append((nxt, 0))
+                    descended = True
+                    break
+                if on_stack[nxt]:
+                    low[node] = min(low[node], index[nxt])
+            if descended:
+                continue
+
+            # all successors explored, close the component if node is its root
+            if low[node] == index[node]:
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    comp_of[member] = len(components)
+                    members.append(member)
+                    if member == node:
+                        break
+                components.append(members)
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+    return comp_of, components
+
+
+def build_reachability(linkages, all_nodes_down):
+    """ produce the reachability index of the knowledge tree. The
+    transitive closure of the condensed graph is stored as one bitset
+    (a python int) per component. A component only contains its own
+    bit if it is part of a loop.
+    """
+    nodes, node_idx, successors = build_graph(linkages, all_nodes_down)
+    comp_of, components = find_components(successors)
+    reach = [0] * len(components)
+
+    # successor components are always finished before their predecessors
+    for comp, members in enumerate(components):
+        bits = 0
+        cyclic = len(members) > 1
+        for member in members:
+            for nxt in successors[member]:
+                nxt_comp = comp_of[nxt]
+                if nxt_comp == comp:
+                    cyclic = True
+                else:
+                    bits |= reach[nxt_comp] | (1 << nxt_comp)
+        if cyclic:
+            bits |= 1 << comp
+        reach[comp] = bits
+
+    return {
+        'nodes': nodes,
+        'node_idx': node_idx,
+        'comp_of': comp_of,
+        'components': components,
+        'reach': reach
+    }
+
+
+def is_prerequisite(index, node_a, node_b):
+    """ check whether `node_a` is a (transitive) prerequisite of `node_b`.
+    Nodes are given as (name, depth) pairs.
+    """
+    idx_a = index['node_idx'].get(tuple(node_a))
+    idx_b = index['node_idx'].get(tuple(node_b))
+    if idx_a is None or idx_b is None:
+        return False
+
+    comp_a = index['comp_of'][idx_a]
+    comp_b = index['comp_of'][idx_b]
+    return bool(index['reach'][comp_a] >> comp_b & 1)
+
+
+def get_unlocked(index, node):
+    """ return all the nodes that `node` is a prerequisite of.
+    """
+    idx = index['node_idx'].get(tuple(node))
+    if idx is None:
+        return []
+
+    unlocked = []
+    bits = index['reach'][index['comp_of'][idx]]
+    while bits:
+        low_bit = bits & -bits
+        for member in index['components'][low_bit.bit_length() - 1]:
+            unlocked.append(index['nodes'][member])
+        bits ^= low_bit
+
+    return unlocked
+
+
+def get_prerequisites(index, node):
+    """ return all the nodes that are prerequisites of `node`.
+    Note: this has to look through the bitset of every component.
+    """
+    idx = index['node_idx'].get(tuple(node))
+    if idx is None:
+        return []
+
+    comp = index['comp_of'][idx]
+    prerequisites = []
+    for other, bits in enumerate(index['reach']):
+        if bits >> comp & 1:
+            for member in index['components'][other]:
+                prerequisites.append(index['nodes'][member])
+
+    return prerequisites
+
+
+def save_reachability(index, fpath_output):
+    """ write the reachability index next to the other outputs.
+    """
+    data = {
+        'nodes': [list(node) for node in index['nodes']],
+        'comp_of': index['comp_of'],
+        'reach': [format(bits, 'x') for bits in index['reach']]
+    }
+    with open(f"{fpath_output}/{FNAME_REACH}.json", 'w', encoding='utf-8') as jsonf:
+        jsonf.write(json.dumps(data))
+
+
+def load_reachability(fpath_index):
+    """ read a saved reachability index so that it can be queried again.
+    """
+    with open(fpath_index, 'r', encoding='utf-8') as jsonf:
+        data = json.load(jsonf)
+
+    nodes = [tuple(node) for node in data['nodes']]
+    components = [[] for _ in data['reach']]
+    for member, comp in enumerate(data['comp_of']):
+        components[comp].append(member)
+
+    return {
+        'nodes': nodes,
+        'node_idx': {node: i for i, node in enumerate(nodes)},
+        'comp_of': data['comp_of'],
+        'components': components,
+        'reach': [int(bits, 16) for bits in data['reach']]
+    }
@@ -0,0 +1,237 @@
+"""
+This program runs a long lived local service that keeps the parsed
+input files in memory, so an editor can validate the knowledge tree
+on every save without paying for start up and parsing each time.
+Files are only read again when they change on disk.
+
+Start it with: python -m tree_library.service [port]
+It prints a token for this run, which is also written to the file
+~/.knowledge_tree_token. POST a JSON object (Content-Type
+application/json) with the token in the X-Service-Token header and
+the arguments of the function to
+http://127.0.0.1:<port>/<function>, e.g. /validate_tree with
+{"fpath_keys": ..., "fpath_master": ..., "fpath_compared": ..., "fpath_output": ...}
+or /strongest_path with {"method": ..., "fpath_tree": ..., "fpath_link": ...,
+"source": [name, depth], "target": [name, depth]}
+Author: Yi Ding
+Version: 1.0
+"""
+
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tree_library.json_tree_modified import read_tree_rows, write_json_tree
+from tree_library.tree_validation import read_keys, read_study_design, read_tree_data, check_tree
+from tree_library.node_link_validation import get_nodes, read_linkage, check_linkage
+from tree_library.tree_diff import diff_trees
+from tree_library.prerequisite_paths import create_path_engine, strongest_path as find_strongest_path
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_CACHED = 32  # parsed files kept, the least recently used go first
+MAX_BODY = 2 ** 20
+TOKEN_HEADER = "X-Service-Token"
+FPATH_TOKEN = os.path.join(os.path.expanduser("~"), ".knowledge_tree_token")
+
+cache = OrderedDict()
+cache_lock = threading.Lock()
+file_locks = {}
+
+
+def get_stamp(fpath):
+    """ the modification time and size of a file, which change when it is saved
+    """
+    stat = os.stat(fpath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_cached(loader, fpaths, *args):
+    """ return loader(*args), reusing the last result for as long as
+    none of the files in `fpaths` changed on disk. Loads of the same
+    files wait for each other, loads of different files run at once.
+    Only the MAX_CACHED most recently used results are kept.
+    """
+    key = (loader.__name__, tuple(fpaths), args)
+    with cache_lock:
+        lock = file_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        stamps = tuple(get_stamp(fpath) for fpath in fpaths)
+        with cache_lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] == stamps:
+                cache.move_to_end(key)
+                return entry[1]
+
+        try:
+            value = loader(*args)
+        except Exception:
+            with cache_lock:
+                if key not in cache:
+                    file_locks.pop(key, None)
+            raise
+
+        with cache_lock:
+            cache[key] = (stamps, value)
+            cache.move_to_end(key)
+            while len(cache) > MAX_CACHED:
+                old_key, _ = cache.popitem(last=False)
+                file_locks.pop(old_key, None)
+        return value
+
+
+def load_nodes(fpath_tree):
+    """ parent and children relationships of the tree design file
+    """
+    all_nodes_down = {}
+    all_nodes_up = {}
+    get_nodes(fpath_tree, all_nodes_down, all_nodes_up)
+    return all_nodes_down, all_nodes_up
+
+
+def load_linkage(method, fpath_tree, fpath_link):
+    """ validated linkages, which depend on the tree design file as well
+    """
+    all_nodes_down, _ = load_cached(load_nodes, [fpath_tree], fpath_tree)
+    return read_linkage(method, fpath_link, all_nodes_down)
+
+
+def load_path_engine(method, fpath_tree, fpath_link):
+    """ query engine over the weighted links, its cache of searches is
+    kept for as long as the files do not change
+    """
+    link_data = load_cached(load_linkage, [fpath_tree, fpath_link], method, fpath_tree, fpath_link)
+    return create_path_engine(link_data['link_weights'])
+
+
+def create_json_tree(fpath_tree, fpath_output, split_years=False, sharded=False):
+    """ same as json_tree_modified.create_json_tree with cached input
+    """
+    rows = load_cached(read_tree_rows, [fpath_tree], fpath_tree)
+    write_json_tree(rows, fpath_output, split_years, sharded)
+
+
+def validate_tree(fpath_keys, fpath_master, fpath_compared, fpath_output):
+    """ same as tree_validation.validate_tree with cached input
+    """
+    keys = load_cached(read_keys, [fpath_keys], fpath_keys)
+    design = load_cached(read_study_design, [fpath_master], fpath_master)
+    compared_data, all_nodes = load_cached(read_tree_data, [fpath_compared], fpath_compared)
+    check_tree(keys, design, compared_data, all_nodes, fpath_output)
+
+
+def process_linkage(method, fpath_tree, fpath_link, fpath_output, path_targets=None):
+    """ same as node_link_validation.process_linkage with cached input
+    """
+    all_nodes_down, all_nodes_up = load_cached(load_nodes, [fpath_tree], fpath_tree)
+    link_data = load_cached(load_linkage, [fpath_tree, fpath_link], method, fpath_tree, fpath_link)
+    check_linkage(method, link_data, all_nodes_down, all_nodes_up, fpath_output, path_targets)
+
+
+def strongest_path(method, fpath_tree, fpath_link, source, target):
+    """ strongest prerequisite chain from the node `source` to the node
+    `target`, both given as [name, depth]
+    """
+    engine = load_cached(load_path_engine, [fpath_tree, fpath_link], method, fpath_tree, fpath_link)
+    strength, path = find_strongest_path(engine, source, target)
+    return {"strength": strength, "path": [list(node) for node in path]}
+
+
+REQUESTS = {
+    "create_json_tree": create_json_tree,
+    "validate_tree": validate_tree,
+    "process_linkage": process_linkage,
+    "diff_trees": diff_trees,
+    "strongest_path": strongest_path
+}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ handles one request per thread, the reply is a JSON object
+    with "status" set to "ok" or "error" and the "result" of queries.
+    Web pages cannot use the service: requests must carry the token of
+    this run, be JSON and come without a foreign Origin.
+    """
+
+    def do_POST(self):
+        error = self.check_request()
+        if error:
+            self.reply(error[0], {"status": "error", "message": error[1]})
+            return
+
+        request = REQUESTS.get(self.path.strip('/'))
+        if request is None:
+            self.reply(404, {"status": "error", "message": f"Unknown request {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_BODY:
+                raise ValueError("request body is too large")
+            result = request(**json.loads(self.rfile.read(length) or b'{}'))
+        except Exception as e:
+            self.reply(400, {"status": "error", "message": f"Error: {e}"})
+            return
+
+        reply = {"status": "ok"}
+        if result is not None:
+            reply["result"] = result
+        self.reply(200, reply)
+
+    def check_request(self):
+        """ return (code, message) if the request is not allowed
+        """
+        origin = self.headers.get('Origin')
+        host, port = self.server.server_address[:2]
+        if origin is not None and origin not in (f"http://{host}:{port}", f"http://localhost:{port}"):
+            return 403, f"Requests from {origin} are not allowed"
+
+        token = self.headers.get(TOKEN_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            return 403, f"Missing or wrong {TOKEN_HEADER} header"
+
+        if self.headers.get_content_type() != 'application/json':
+            return 415, "Content-Type must be application/json"
+
+        return None
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def save_token(token, fpath=FPATH_TOKEN):
+    """ write the token to a file only the user can read
+    """
+    fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token)
+
+
+def run_service(host=HOST, port=PORT):
+    """ serve requests until the process is stopped. A new token is
+    made for every run.
+    """
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.token = secrets.token_urlsafe(32)
+    save_token(server.token)
+    print(f"Knowledge tree service running on http://{host}:{port}")
+    print(f"{TOKEN_HEADER}: {server.token} (saved to {FPATH_TOKEN})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    run_service(port=int(sys.argv[1]) if len(sys.argv) > 1 else PORT)
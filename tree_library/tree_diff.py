@@ -0,0 +1,204 @@
+"""
+This program computes a content hash for every subtree of the
+knowledge tree and compares two versions of the tree. Only the
+subtrees whose hashes differ are searched, so the comparison takes
+time proportional to the change rather than the size of the tree.
+
+Run it with: python -m tree_library.tree_diff <old> <new> <output directory>
+where <old> and <new> are tree design files (.csv) or snapshots
+(tree_hashes.json written next to the JSON tree files).
+Author: Yi Ding
+Version: 1.0
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+
+DEPTH = 4
+FNAME_HASH = "tree_hashes"
+FNAME_DIFF = "tree_diff_report.txt"
+N_LENGTH = 100
+
+
+def get_hash(*parts):
+    """ hash a number of strings into a short hex digest
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def build_hash_tree(data):
+    """ construct the area --> topic --> subtopic --> content tree from
+    the rows of the csv file `data` and hash it. Each node stores the
+    hash of what is below it ('content') and the hash of itself
+    including its name ('hash'). Content nodes hash their year levels
+    and content tags.
+    """
+    root = {'children': {}}
+    all_fields = data.fieldnames
+
+    for row in data:
+        track = root
+        for field in all_fields[:DEPTH]:
+            track = track['children'].setdefault(row[field], {'children': {}})
+        track.setdefault('tags', []).append(f"Y{row[all_fields[-1]]} {row[all_fields[-2]]}")
+
+    hash_node('', root)
+    return root
+
+
+def hash_node(name, node):
+    """ compute the hashes of a node after its children are hashed.
+    """
+    if 'tags' in node:
+        parts = sorted(node['tags'])
+    else:
+        parts = []
+        for child_name, child in node['children'].items():
+            hash_node(child_name, child)
+            parts.append(child['hash'])
+        parts.sort()
+
+    node['content'] = get_hash(*parts)
+    node['hash'] = get_hash(name, node['content'])
+
+
+def save_snapshot(hash_tree, fpath_output):
+    """ save the hashed tree so that later versions can be compared to it.
+    """
+    with open(f"{fpath_output}/{FNAME_HASH}.json", 'w', encoding='utf-8') as jsonf:
+        jsonf.write(json.dumps(hash_tree))
+
+
+def load_tree(fpath):
+    """ load a hashed tree from a saved snapshot (.json) or
+    build it from a tree design file (.csv).
+    """
+    with open(fpath, 'r', encoding='utf-8') as f:
+        if fpath.lower().endswith('.json'):
+            return json.load(f)
+        return build_hash_tree(csv.DictReader(f))
+
+
+def diff_hash_trees(old_tree, new_tree):
+    """ compare two hashed trees. Return a dictionary with the added,
+    removed, moved and renamed nodes, and the content nodes whose
+    content tags changed. Nodes are given as paths of names.
+    """
+    diff = {'added': [], 'removed': [], 'moved': [], 'renamed': [], 'changed': []}
+    recur_diff(old_tree, new_tree, (), diff)
+    match_moves(diff)
+    return diff
+
+
+def recur_diff(old_node, new_node, path, diff):
+    """ descend into the children of two nodes whose hashes differ.
+    """
+    # the content tags of a content node changed
+    if 'tags' in old_node or 'tags' in new_node:
+        diff['changed'].append(path)
+        return
+
+    old_children = old_node['children']
+    new_children = new_node['children']
+    for name, old_child in old_children.items():
+        if name not in new_children:
+            diff['removed'].append((path + (name,), old_child['content']))
+        elif old_child['hash'] != new_children[name]['hash']:
+            recur_diff(old_child, new_children[name], path + (name,), diff)
+
+    for name, new_child in new_children.items():
+        if name not in old_children:
+            diff['added'].append((path + (name,), new_child['content']))
+
+
+def match_moves(diff):
+    """ pair removed and added subtrees with identical content. The same
+    parent with a new name is a rename, the same name under a new parent
+    is a move. Whatever is left stays added or removed.
+    """
+    added = {}
+    for path, content in diff['added']:
+        added.setdefault(content, []).append(path)
+
+    removed = []
+    for old_path, content in diff['removed']:
+        candidates = added.get(content, [])
+        match = None
+        for new_path in candidates:
+            same_parent = len(new_path) == len(old_path) and new_path[:-1] == old_path[:-1]
+            if same_parent or new_path[-1] == old_path[-1]:
+                match = new_path
+                break
+
+        if match is None:
+            removed.append(old_path)
+            continue
+        candidates.remove(match)
+        if match[:-1] == old_path[:-1]:
+            diff['renamed'].append((old_path, match))
+        else:
+            diff['moved'].append((old_path, match))
+
+    diff['removed'] = removed
+    diff['added'] = [path for paths in added.values() for path in paths]
+
+
+def generate_report(diff, fpath_output):
+    """ produce a .txt report that lists the differences between two trees
+    """
+    f = open(f"{fpath_output}/{FNAME_DIFF}", "w", encoding='utf-8')
+    sections = [
+        ('added', "nodes were added:"),
+        ('removed', "nodes were removed:"),
+        ('changed', "content nodes have different content tags:")
+    ]
+
+    for key, title in sections:
+        f.write('-'*N_LENGTH + '\n')
+        if diff[key]:
+            f.write(f"{len(diff[key])} {title}" + '\n')
+            for path in diff[key]:
+                f.write(f"Depth {len(path)}: {' --> '.join(path)}" + '\n')
+        else:
+            f.write(f"No nodes {key}." + '\n')
+
+    # output the subtrees that were moved or renamed
+    for key, title in [('moved', "nodes were moved:"), ('renamed', "nodes were renamed:")]:
+        f.write('-'*N_LENGTH + '\n')
+        if diff[key]:
+            f.write(f"{len(diff[key])} {title}" + '\n')
+            for old_path, new_path in diff[key]:
+                f.write(f"Depth {len(old_path)}: {' --> '.join(old_path)}" + '\n')
+                f.write(f"{'':9s}now {' --> '.join(new_path)}" + '\n')
+        else:
+            f.write(f"No nodes {key}." + '\n')
+
+    f.write('-'*N_LENGTH + '\n')
+    f.close()
+
+
+def diff_trees(fpath_old, fpath_new, fpath_output):
+    """ driver program for comparing two versions of the knowledge tree,
+    each given as a tree design file or a saved snapshot.
+    """
+    old_tree = load_tree(fpath_old)
+    new_tree = load_tree(fpath_new)
+    diff = diff_hash_trees(old_tree, new_tree)
+    generate_report(diff, fpath_output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two versions of the knowledge tree.")
+    parser.add_argument('old', help="older tree design file (.csv) or snapshot (.json)")
+    parser.add_argument('new', help="newer tree design file (.csv) or snapshot (.json)")
+    parser.add_argument('output', help=f"directory to write {FNAME_DIFF} to")
+    args = parser.parse_args()
+
+    diff_trees(args.old, args.new, args.output)
+    print(f"Report saved to {args.output}/{FNAME_DIFF}")
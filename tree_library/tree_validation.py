@@ -6,8 +6,13 @@ Version: 1.0
 '''
 
 import csv
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from tree_library.lazy_csv import LazyCSV
 
 SIM_THRESHOLD = 0.5  # control the standard for similarity
+SIM_CACHE_SIZE = 2 ** 16  # similarity scores kept between runs
 DEPTH = 4
 COURSES = {
     "Mathematics": "",
@@ -22,16 +27,18 @@ def compare(master_data, compared_data, all_nodes, fpath_output):
     """
 
     # count frequency of content tags and search for differences
-    master_freq = {x: master_data.count(x) for x in master_data}
-    compared_freq = {x: compared_data.count(x) for x in compared_data}
-    missing_data = set(master_data) - set(compared_data)
-    extra_data = set(compared_data) - set(master_data)
-    common_data = set(master_data) & set(compared_data)
+    master_freq = Counter(master_data)
+    compared_freq = Counter(compared_data)
+    missing_data = master_freq.keys() - compared_freq.keys()
+    extra_data = compared_freq.keys() - master_freq.keys()
+    common_data = master_freq.keys() & compared_freq.keys()
     discrepancy = {}
 
-    # calculate similarity score for nodes' names
-    suggestions = get_similarity_pairs(list(missing_data), list(extra_data))
-    sus_nodes = find_sus_nodes(all_nodes)
+    # pair up names that only differ after normalization, then calculate
+    # similarity score for the rest of the nodes' names
+    tag_collisions, missing_left, extra_left = find_collisions(list(missing_data), list(extra_data))
+    suggestions = get_similarity_pairs(missing_left, extra_left)
+    sus_nodes, node_collisions = find_sus_nodes(all_nodes)
     
     # search for discrepancies that is content appeared more than once
     for item in common_data:
@@ -40,7 +47,64 @@ def compare(master_data, compared_data, all_nodes, fpath_output):
             discrepancy[item] = diff
 
     # generate an output report for all the errors
-    generate_report(missing_data, extra_data, discrepancy, suggestions, sus_nodes, fpath_output)
+    breakdown = get_breakdown(missing_data, extra_data, discrepancy)
+    generate_report(missing_data, extra_data, discrepancy, breakdown, suggestions, sus_nodes,
+                    tag_collisions, node_collisions, fpath_output)
+
+
+def get_breakdown(missing_data, extra_data, discrepancy):
+    """ count the missing, extra and repeated content tags of each
+    year level and course, e.g. "10 GM".
+    """
+    breakdown = {}
+    for idx, data in enumerate([missing_data, extra_data, discrepancy]):
+        for grade, _ in data:
+            breakdown.setdefault(grade, [0, 0, 0])[idx] += 1
+
+    return breakdown
+
+
+def grade_order(grade):
+    """ sort year levels by number first and then by course
+    """
+    year, _, course = grade.partition(' ')
+    return (int(year) if year.isdigit() else float('inf'), year, course)
+
+
+def normalize_name(name):
+    """ produce the canonical key of a name, which ignores case, spacing,
+    punctuation and the unicode form of the characters.
+    """
+    name = unicodedata.normalize('NFKC', name).casefold()
+    return ''.join(ch for ch in name if not (ch.isspace() or unicodedata.category(ch).startswith('P')))
+
+
+def find_collisions(list1, list2):
+    """ pair up the (key, name) items of the two lists whose names are the
+    same after normalization. Return the pairs and the items left over
+    for fuzzy matching.
+    """
+    pairs = []
+    canonical = {}
+    for j, item in enumerate(list2):
+        canonical.setdefault((item[0], normalize_name(item[1])), []).append(j)
+
+    # every item can only be paired once, with the earliest unpaired match
+    left1 = []
+    paired2 = set()
+    for item in list1:
+        matches = canonical.get((item[0], normalize_name(item[1])))
+        if matches:
+            j = matches.pop(0)
+            paired2.add(j)
+            pairs.append((item, list2[j]))
+        else:
+            left1.append(item)
+
+    # the left over items keep their order, which decides ties in fuzzy matching
+    left2 = [item for j, item in enumerate(list2) if j not in paired2]
+
+    return pairs, left1, left2
 
 
 def levenshtein_distance(str1, str2):
@@ -74,6 +138,7 @@ def levenshtein_distance(str1, str2):
     return dp[len_str1][len_str2]
 
 
+@lru_cache(maxsize=SIM_CACHE_SIZE)
 def levenshtein_ratio(str1, str2):
     """ compute a normalized similarity score for two strings
     """
@@ -97,37 +162,28 @@ def get_similarity_pairs(list1, list2, threshold=SIM_THRESHOLD):
     used_list1 = set()
     used_list2 = set()
 
-    # iterate through all pairs of nodes
-    while len(used_list1) < len(list1) and len(used_list2) < len(list2):
-        best_pair = None
-        best_score = 0
-        
-        for i, (key1, str1) in enumerate(list1):
-            if i in used_list1:
-                continue
-            for j, (key2, str2) in enumerate(list2):
-                if j in used_list2:
-                    continue
-                
-                # First check if the keys (str1 part) match exactly
-                if key1 == key2:
-                    # If the keys match, compare str2 for similarity
-                    score = levenshtein_ratio(str1, str2)
-                    
-                    if score > best_score and score >= threshold:
-                        best_score = score
-                        best_pair = (i, j)
-        
-        if best_pair:
-            i, j = best_pair
-            # Append the matching pair from both lists
-            pairs.append((list1[i], list2[j]))
-            used_list1.add(i)
-            used_list2.add(j)
-        else:
-            # If no pair meets the threshold, break the loop
-            break
-    
+    # only content tags with the same key (grade) are compared
+    key_index = {}
+    for j, (key2, _) in enumerate(list2):
+        key_index.setdefault(key2, []).append(j)
+
+    # score every pair once
+    candidates = []
+    for i, (key1, str1) in enumerate(list1):
+        for j in key_index.get(key1, []):
+            score = levenshtein_ratio(str1, list2[j][1])
+            if score > 0 and score >= threshold:
+                candidates.append((-score, i, j))
+
+    # take the best remaining pair each time, ties go to the earliest pair
+    candidates.sort()
+    for _, i, j in candidates:
+        if i in used_list1 or j in used_list2:
+            continue
+        pairs.append((list1[i], list2[j]))
+        used_list1.add(i)
+        used_list2.add(j)
+
     return pairs
 
 
@@ -150,10 +206,12 @@ def find_similar(node_lst, threshold=SIM_THRESHOLD):
 def find_sus_nodes(all_nodes):
     """ iterate through each layer of the knowledge tree
     and then find nodes with similar names. Return the
-    pairs of similar nodes in each layer.
+    pairs of similar nodes in each layer and the pairs of
+    nodes whose names are the same after normalization.
     """
 
     sus_node_pairs = []
+    collision_pairs = []
     node_storage = [set() for _ in range(DEPTH)]
     
     # store all nodes in their respective layer
@@ -163,14 +221,23 @@ def find_sus_nodes(all_nodes):
     
     # iterate through each layer to find similar nodes
     for node_set in node_storage:
-        node_lst = list(node_set)
+
+        # only one node of each normalization group needs fuzzy matching
+        groups = {}
+        for node in node_set:
+            groups.setdefault(normalize_name(node[1]), []).append(node)
+        for group in groups.values():
+            collision_pairs += [(group[0], node) for node in group[1:]]
+
+        node_lst = [group[0] for group in groups.values()]
         suggestions = find_similar(node_lst, 0.9)
         sus_node_pairs += suggestions
 
-    return sus_node_pairs
+    return sus_node_pairs, collision_pairs
 
 
-def generate_report(missing_data, extra_data, discrepancy, suggestions, sus_nodes, fpath_output):
+def generate_report(missing_data, extra_data, discrepancy, breakdown, suggestions, sus_nodes,
+                    tag_collisions, node_collisions, fpath_output):
     """ produce a .txt report that reports the errors in the knowledge tree
     """
     f = open(fpath_output, "w")
@@ -206,6 +273,16 @@ def generate_report(missing_data, extra_data, discrepancy, suggestions, sus_node
     else:
         f.write("No more discrepancies found." + '\n')
 
+    # output the number of errors for each year level and course
+    f.write("-" * N_LENGTH + '\n')
+    if breakdown:
+        f.write(f"Breakdown by year level and course:" + '\n')
+        f.write("{:<8}{:<9}{:<7}{}".format("grade", "missing", "extra", "repeated") + '\n')
+        for grade in sorted(breakdown, key=grade_order):
+            f.write("{:<8}{:<9}{:<7}{}".format(grade, *breakdown[grade]) + '\n')
+    else:
+        f.write("No errors for any year level or course." + '\n')
+
     # output suggestions for fixes
     f.write("-" * N_LENGTH + '\n')
     if suggestions:
@@ -216,6 +293,16 @@ def generate_report(missing_data, extra_data, discrepancy, suggestions, sus_node
     else:
         f.write("No available suggestions." + '\n')
 
+    # output tags that only differ in case, spacing, punctuation or unicode form
+    f.write("-" * N_LENGTH + '\n')
+    if tag_collisions:
+        padding = len(max(tag_collisions, key=lambda x: len(x[1][1]))[1][1])
+        f.write(f"Below are content tags that collide after normalization:" + '\n')
+        for str1, str2 in tag_collisions:
+            f.write(f"{str1[0]}: {str2[1].ljust(padding)} --> {str1[1]}" + '\n')
+    else:
+        f.write("No normalization collisions for content tags." + '\n')
+
     # output warnings for nodes with high level of similarity for name
     f.write("-" * N_LENGTH + '\n')
     if sus_nodes:
@@ -225,20 +312,25 @@ def generate_report(missing_data, extra_data, discrepancy, suggestions, sus_node
             f.write(f"Depth {node1[0]}: {node1[1].ljust(padding)} <--> {node2[1]}" + '\n')
     else:
         f.write("All nodes seemed to be alright." + '\n')
+
+    # output nodes whose names only differ in case, spacing, punctuation or unicode form
+    f.write("-" * N_LENGTH + '\n')
+    if node_collisions:
+        padding = len(max(node_collisions, key=lambda x: len(x[0][1]))[0][1])
+        f.write(f"Below are nodes with names that collide after normalization:" + '\n')
+        for node1, node2 in node_collisions:
+            f.write(f"Depth {node1[0]}: {node1[1].ljust(padding)} <--> {node2[1]}" + '\n')
+    else:
+        f.write("No normalization collisions for node names." + '\n')
     
     f.write("-" * N_LENGTH + '\n')
     f.close()
 
 
-def validate_tree(fpath_keys, fpath_master, fpath_compared, fpath_output):
-    """ driver program for validation the design of the JSON tree
+def read_keys(fpath_keys):
+    """ find all the (year level, topic) pairs the user is working on
     """
-    master_data = []
-    compared_data = []
-    all_nodes = set()
     keys = []
-
-    # find all the topics the user is working on
     with open(fpath_keys, 'r', encoding='utf-8') as csvf:
 
         csvReader = csv.DictReader(csvf)
@@ -246,26 +338,57 @@ def validate_tree(fpath_keys, fpath_master, fpath_compared, fpath_output):
         for row in csvReader:
             keys.append((row[year_level], row[topic]))
 
-    # read the given current study design
+    return keys
+
+
+def read_study_design(fpath_master):
+    """ read the given current study design as (grade, topic, content)
+    """
+    design = []
     with open(fpath_master, 'r', encoding='utf-8') as csvf:
         csvReader = csv.DictReader(csvf)
         course, rawgrade, area, topic, sub_topic, content = csvReader.fieldnames[:6]
         for row in csvReader:
             grade = f"{row[rawgrade]}{COURSES[row[course]]}"
-            row_key = (grade, row[topic])
-            if row_key in keys:
-                master_data.append((grade, row[content]))
-    
-    # read the knowledge tree design file
-    with open(fpath_compared, 'r', encoding='utf-8') as csvf:
-        
-        csvReader = csv.DictReader(csvf)
-        fields = csvReader.fieldnames
-        
-        for row in csvReader:
-            compared_data.append((row[fields[-1]], row[fields[-2]]))
-            all_nodes.add(tuple(row[fields[x]] for x in range(DEPTH)))
+            design.append((grade, row[topic], row[content]))
+
+    return design
+
+
+def read_tree_data(fpath_compared):
+    """ read the content tags and the nodes of the knowledge tree design file
+    """
+    compared_data = []
+    all_nodes = set()
+    with LazyCSV(fpath_compared) as csv_data:
+
+        # only the node and content tag columns are decoded
+        fields = csv_data.fieldnames
+        for row in csv_data.iter_columns(fields[:DEPTH] + fields[-2:]):
+            compared_data.append((row[-1], row[-2]))
+            all_nodes.add(row[:DEPTH])
+
+    return compared_data, all_nodes
+
+
+def check_tree(keys, design, compared_data, all_nodes, fpath_output):
+    """ compare the chosen topics of the study design with the knowledge tree
+    """
+    master_data = []
+    keys = set(keys)
+    for grade, topic, content in design:
+        if (grade, topic) in keys:
+            master_data.append((grade, content))
 
-    # compare the current study design and knowledge tree design
     compare(master_data, compared_data, all_nodes, fpath_output)
 
+
+def validate_tree(fpath_keys, fpath_master, fpath_compared, fpath_output):
+    """ driver program for validation the design of the JSON tree
+    """
+    keys = read_keys(fpath_keys)
+    design = read_study_design(fpath_master)
+    compared_data, all_nodes = read_tree_data(fpath_compared)
+
+    # compare the current study design and knowledge tree design
+    check_tree(keys, design, compared_data, all_nodes, fpath_output)